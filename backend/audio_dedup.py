@@ -0,0 +1,263 @@
+## Import statements ##
+import hashlib
+import json
+import os
+from collections import namedtuple
+import numpy as np
+
+# Haitsma-Kalker style framing: long overlapping frames with a hop of 1/32 of a frame, so a copy that is shifted
+# by a fraction of a hop (eg, by the priming delay of an MP3/AAC encoder) still gives almost the same bits
+FINGERPRINT_SAMPLE_RATE = 8000
+FINGERPRINT_FRAME_LENGTH = 2944  # 0.368 sec at 8 kHz
+FINGERPRINT_HOP_LENGTH = 92  # 0.0115 sec at 8 kHz, ie, 1/32 of a frame
+FINGERPRINT_NUM_BANDS = 17  # 17 bands give 16 bits per frame
+FINGERPRINT_MIN_FREQ = 300
+FINGERPRINT_MAX_FREQ = 3000
+
+MAX_BIT_ERROR_RATE = 0.15  # Re-encoded copies of the same audio stay well below this, unrelated audio is around 0.5
+MIN_OVERLAP_FRACTION = 0.9  # Share of the shorter recording that must overlap the longer one
+# Max difference (in sec) in length and alignment for outputs to be reused as they are. This only allows for the
+# priming delay and padding of audio encoders (a few hops), since the timestamps of the outputs are not shifted
+MAX_REUSE_DIFFERENCE = 0.05
+
+# The registry keeps an inverted index of anchors: 32 bit keys made of 2 fingerprint frames ANCHOR_SPACING frames
+# apart, taken every ANCHOR_STEP frames of each registered file. Looking up the keys of every frame of a new file
+# gives votes for (registered file, alignment) pairs, so only a few candidates need to be compared bit by bit.
+ANCHOR_SPACING = 16
+ANCHOR_STEP = 32
+MAX_ANCHOR_BUCKET = 100  # Keys shared by more anchors (eg, silence) say nothing about the alignment
+MIN_ANCHOR_VOTES = 3
+MAX_CANDIDATES = 5
+
+DuplicateMatch = namedtuple("DuplicateMatch", ["source_file", "kind", "offset", "bit_error_rate", "outputs"])
+
+
+def hash_pcm(waveform) -> str:
+    """Returns the SHA-256 hex digest of the decoded PCM samples in waveform (a 1D numpy array)."""
+    return hashlib.sha256(np.ascontiguousarray(waveform, dtype=np.float32).tobytes()).hexdigest()
+
+
+def job_key(output_format: str, model_size: str, to_english_selection: str, long_audio_mode: bool,
+            uses_speaker_index: bool) -> str:
+    """
+    Returns the key under which the outputs of a job are recorded in the registry. Outputs are only reused
+    for a job with the same process, model size, language selection and speaker diarization settings.
+    """
+    return json.dumps({
+        "output_format": output_format,
+        "model_size": model_size,
+        "to_english_selection": to_english_selection,
+        "long_audio_mode": bool(long_audio_mode),
+        "uses_speaker_index": bool(uses_speaker_index),
+    }, sort_keys=True)
+
+
+def compute_fingerprint(waveform, sample_rate: int = 16000):
+    """
+    This method returns a spectral fingerprint of waveform (a 1D numpy array of decoded PCM samples) as a
+    1D numpy array with one uint16 per FINGERPRINT_HOP_LENGTH samples at 8 kHz (about 87 per sec of audio).
+
+    The audio is downsampled to 8 kHz and each frame is split into 17 log-spaced frequency bands. Each of the
+    16 bits of a frame tells whether the energy difference between 2 neighbouring bands grows or shrinks
+    compared to the previous frame, so the fingerprint does not depend on the file format, bitrate or volume.
+    """
+    waveform = np.asarray(waveform, dtype=np.float32)
+    # Downsample by averaging blocks of samples (a cheap low-pass filter)
+    decimation = max(1, sample_rate // FINGERPRINT_SAMPLE_RATE)
+    num_samples = len(waveform) // decimation * decimation
+    waveform = waveform[:num_samples].reshape(-1, decimation).mean(axis=1)
+    if len(waveform) < FINGERPRINT_FRAME_LENGTH:
+        return np.zeros(0, dtype=np.uint16)
+
+    frequencies = np.fft.rfftfreq(FINGERPRINT_FRAME_LENGTH, d=1.0 / FINGERPRINT_SAMPLE_RATE)
+    band_edges = np.geomspace(FINGERPRINT_MIN_FREQ, FINGERPRINT_MAX_FREQ, FINGERPRINT_NUM_BANDS + 1)
+    band_of_bin = np.digitize(frequencies, band_edges) - 1
+    # (num_bins, num_bands) matrix summing the power of the frequency bins of each band
+    band_matrix = (band_of_bin[:, None] == np.arange(FINGERPRINT_NUM_BANDS)[None, :]).astype(np.float32)
+    window = np.hanning(FINGERPRINT_FRAME_LENGTH).astype(np.float32)
+
+    frames = np.lib.stride_tricks.sliding_window_view(waveform, FINGERPRINT_FRAME_LENGTH)[::FINGERPRINT_HOP_LENGTH]
+    band_energy = np.empty((len(frames), FINGERPRINT_NUM_BANDS), dtype=np.float64)
+    # Process the frames in chunks so memory use stays bounded on multi-hour recordings
+    for chunk_start in range(0, len(frames), 4096):
+        power = np.abs(np.fft.rfft(frames[chunk_start:chunk_start + 4096] * window, axis=1)) ** 2
+        band_energy[chunk_start:chunk_start + 4096] = power.astype(np.float32) @ band_matrix
+
+    band_diff = band_energy[:, :-1] - band_energy[:, 1:]
+    bits = np.zeros_like(band_diff, dtype=bool)
+    bits[1:] = (band_diff[1:] - band_diff[:-1]) > 0
+    return np.packbits(bits, axis=1, bitorder="little").view(np.uint16).reshape(-1)
+
+
+def _anchor_keys(fingerprint):
+    """Returns the 32 bit anchor key starting at each frame of fingerprint (see ANCHOR_SPACING)."""
+    if len(fingerprint) <= ANCHOR_SPACING:
+        return np.zeros(0, dtype=np.uint32)
+    return (fingerprint[:-ANCHOR_SPACING].astype(np.uint32) << 16) | fingerprint[ANCHOR_SPACING:].astype(np.uint32)
+
+
+def _bit_error_rate(fingerprint_a, fingerprint_b, offset: int):
+    """
+    Returns a tuple (bit_error_rate, overlap_length) between fingerprint_a and fingerprint_b, where frame i of
+    fingerprint_b is aligned with frame i + offset of fingerprint_a.
+    """
+    start_a = max(0, offset)
+    start_b = max(0, -offset)
+    overlap_length = min(len(fingerprint_a) - start_a, len(fingerprint_b) - start_b)
+    if overlap_length <= 0:
+        return 1.0, 0
+    xor = np.bitwise_xor(fingerprint_a[start_a:start_a + overlap_length], fingerprint_b[start_b:start_b + overlap_length])
+    num_differing_bits = np.unpackbits(xor.view(np.uint8)).sum()
+    return float(num_differing_bits) / (16.0 * overlap_length), overlap_length
+
+
+def _verify_alignment(fingerprint_a, fingerprint_b, offset: int):
+    """
+    Returns a tuple (offset, bit_error_rate) for the best alignment of fingerprint_b against fingerprint_a within
+    1 frame of offset (frame i of fingerprint_b aligned with frame i + offset of fingerprint_a), or None if the
+    2 fingerprints do not overlap on at least MIN_OVERLAP_FRACTION of the shorter one with a bit error rate of at
+    most MAX_BIT_ERROR_RATE.
+    """
+    min_overlap_length = MIN_OVERLAP_FRACTION * min(len(fingerprint_a), len(fingerprint_b))
+    best = None
+    for candidate_offset in (offset - 1, offset, offset + 1):
+        bit_error_rate, overlap_length = _bit_error_rate(fingerprint_a, fingerprint_b, candidate_offset)
+        if overlap_length >= min_overlap_length and bit_error_rate <= MAX_BIT_ERROR_RATE:
+            if best is None or bit_error_rate < best[1]:
+                best = (candidate_offset, bit_error_rate)
+    return best
+
+
+class DedupRegistry:
+    """
+    A persistent registry of the audio files that have already been processed, and of their outputs.
+
+    The registry is stored in registry_dir as an index.json file, an anchors.npz inverted index of anchor keys,
+    and one .npy fingerprint file per entry. Before a file is processed, find_match looks for an earlier entry
+    with the same audio so its outputs can be reused instead of running diarization and transcription again.
+    Finding candidates only takes a lookup in the inverted index, and only the fingerprints of the few
+    candidates are read from disk.
+    """
+
+    def __init__(self, registry_dir: str):
+        self.registry_dir = registry_dir
+        self.index_path = os.path.join(registry_dir, "index.json")
+        self.anchors_path = os.path.join(registry_dir, "anchors.npz")
+        self.entries = {}  # maps PCM hash to a dict with keys: source_file, duration, outputs
+        self.entry_hashes = []  # PCM hash of each entry number used in the inverted index
+        self.anchor_keys = np.zeros(0, dtype=np.uint32)  # sorted
+        self.anchor_entries = np.zeros(0, dtype=np.int32)
+        self.anchor_positions = np.zeros(0, dtype=np.int32)
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, "r") as index_file:
+                self.entries = json.load(index_file)
+        if os.path.isfile(self.anchors_path):
+            with np.load(self.anchors_path) as anchors_file:
+                self.entry_hashes = [str(entry_hash) for entry_hash in anchors_file["entry_hashes"]]
+                self.anchor_keys = anchors_file["keys"]
+                self.anchor_entries = anchors_file["entries"]
+                self.anchor_positions = anchors_file["positions"]
+
+    def _fingerprint_path(self, pcm_hash: str) -> str:
+        return os.path.join(self.registry_dir, pcm_hash + ".npy")
+
+    def _candidates(self, fingerprint):
+        """
+        Returns up to MAX_CANDIDATES (entry_number, offset) pairs with the most anchor votes, where offset is the
+        frame of the entry aligned with the first frame of fingerprint.
+        """
+        query_keys = _anchor_keys(fingerprint)
+        lo = np.searchsorted(self.anchor_keys, query_keys, side="left")
+        hi = np.searchsorted(self.anchor_keys, query_keys, side="right")
+        bucket_sizes = hi - lo
+        usable = (bucket_sizes > 0) & (bucket_sizes <= MAX_ANCHOR_BUCKET)
+        if not np.any(usable):
+            return []
+        # Expand each usable query frame into the anchors sharing its key
+        bucket_sizes = bucket_sizes[usable]
+        query_positions = np.repeat(np.flatnonzero(usable), bucket_sizes)
+        bucket_starts = np.repeat(lo[usable], bucket_sizes)
+        rank_in_bucket = np.arange(len(query_positions)) - np.repeat(np.cumsum(bucket_sizes) - bucket_sizes, bucket_sizes)
+        anchor_indices = bucket_starts + rank_in_bucket
+
+        pairs = np.stack([self.anchor_entries[anchor_indices].astype(np.int64),
+                          self.anchor_positions[anchor_indices].astype(np.int64) - query_positions], axis=1)
+        pairs, votes = np.unique(pairs, axis=0, return_counts=True)
+        best = np.argsort(votes, kind="stable")[::-1][:MAX_CANDIDATES]
+        return [(int(pairs[i][0]), int(pairs[i][1])) for i in best if votes[i] >= MIN_ANCHOR_VOTES]
+
+    def find_match(self, pcm_hash: str, fingerprint):
+        """
+        Returns a DuplicateMatch for the registry entry whose audio matches the audio with the given PCM hash and
+        fingerprint, or None if there is none. The kind of the match is:
+
+            - "exact": the decoded audio is identical
+            - "near": the same audio, eg re-encoded in another format, with the same length and alignment
+            - "contained": one of the recordings is a trimmed copy of the other
+
+        The offset of the match (in sec) is where the audio starts in the audio of the entry.
+        Outputs can only be reused for "exact" and "near" matches, since the timestamps of a trimmed copy differ.
+        """
+        if pcm_hash in self.entries:
+            entry = self.entries[pcm_hash]
+            return DuplicateMatch(entry["source_file"], "exact", 0.0, 0.0, entry["outputs"])
+
+        best_match = None
+        entry_fingerprints = {}
+        for entry_number, offset in self._candidates(fingerprint):
+            entry_hash = self.entry_hashes[entry_number]
+            if entry_hash not in entry_fingerprints:
+                entry_fingerprints[entry_hash] = np.load(self._fingerprint_path(entry_hash))
+            alignment = _verify_alignment(entry_fingerprints[entry_hash], fingerprint, offset)
+            if alignment is None:
+                continue
+            entry = self.entries[entry_hash]
+            offset_seconds = alignment[0] * FINGERPRINT_HOP_LENGTH / FINGERPRINT_SAMPLE_RATE
+            length_difference = abs(entry["duration"] - len(fingerprint) * FINGERPRINT_HOP_LENGTH / FINGERPRINT_SAMPLE_RATE)
+            if abs(offset_seconds) <= MAX_REUSE_DIFFERENCE and length_difference <= MAX_REUSE_DIFFERENCE:
+                kind = "near"
+            else:
+                kind = "contained"
+            match = DuplicateMatch(entry["source_file"], kind, offset_seconds, alignment[1], entry["outputs"])
+            # Prefer matches whose outputs can be reused, then the closest match
+            if best_match is None or (kind == "near", -alignment[1]) > (best_match.kind == "near", -best_match.bit_error_rate):
+                best_match = match
+        return best_match
+
+    def add(self, pcm_hash: str, fingerprint, source_file: str, job: str, output_csv_path: str,
+            output_parquet_path: str = None) -> None:
+        """
+        Records that the audio with the given PCM hash and fingerprint was processed by the job with the key job
+        (see job_key) into output_csv_path, and into output_parquet_path if a Parquet file was written.
+        """
+        os.makedirs(self.registry_dir, exist_ok=True)
+        if pcm_hash not in self.entries:
+            np.save(self._fingerprint_path(pcm_hash), fingerprint)
+            self.entries[pcm_hash] = {
+                "source_file": source_file,
+                "duration": len(fingerprint) * FINGERPRINT_HOP_LENGTH / FINGERPRINT_SAMPLE_RATE,
+                "outputs": {},
+            }
+            self._add_anchors(pcm_hash, fingerprint)
+        self.entries[pcm_hash]["outputs"][job] = {"csv": output_csv_path, "parquet": output_parquet_path}
+        with open(self.index_path, "w") as index_file:
+            json.dump(self.entries, index_file, indent=2)
+
+    def _add_anchors(self, pcm_hash: str, fingerprint) -> None:
+        """Adds the anchors of fingerprint to the inverted index, and saves it."""
+        entry_number = len(self.entry_hashes)
+        self.entry_hashes.append(pcm_hash)
+        keys = _anchor_keys(fingerprint)[::ANCHOR_STEP]
+        keys = np.concatenate([self.anchor_keys, keys])
+        entries = np.concatenate([self.anchor_entries, np.full(len(keys) - len(self.anchor_keys), entry_number, dtype=np.int32)])
+        positions = np.concatenate([self.anchor_positions,
+                                    np.arange(0, len(keys) - len(self.anchor_keys), dtype=np.int32) * ANCHOR_STEP])
+        order = np.argsort(keys, kind="stable")
+        self.anchor_keys = keys[order]
+        self.anchor_entries = entries[order]
+        self.anchor_positions = positions[order]
+        np.savez(self.anchors_path,
+                 entry_hashes=np.array(self.entry_hashes, dtype=str),
+                 keys=self.anchor_keys,
+                 entries=self.anchor_entries,
+                 positions=self.anchor_positions)
@@ -0,0 +1,108 @@
+## Import statements ##
+import json
+import os
+import subprocess
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+AudioProbe = namedtuple("AudioProbe", ["path", "duration", "sample_rate", "channels", "codec"])
+
+# Rough processing speeds (seconds of audio processed per second) on a laptop CPU. They are only used for the
+# estimates printed before processing starts, and are replaced by the measured speed when processing a batch.
+ESTIMATED_DIARIZATION_SPEED = 2.0
+ESTIMATED_WHISPER_SPEEDS = {"small": 1.0, "medium": 0.5, "large-v2": 0.25}
+
+
+def probe_audio_file(audio_file_path: str) -> AudioProbe:
+    """
+    This method reads the container headers of the audio file at audio_file_path with ffprobe (installed
+    alongside ffmpeg, which Whisper already needs) and returns its duration (in seconds), sample rate,
+    number of channels and codec as an AudioProbe.
+
+    The audio itself is not decoded, so this takes milliseconds even for multi-hour recordings.
+    A ValueError is raised if the file cannot be probed, has no audio stream, or has no duration
+    (eg, a corrupt or truncated file), so that it is rejected before any model is loaded.
+    """
+    command = ["ffprobe", "-v", "error", "-select_streams", "a:0",
+               "-show_entries", "format=duration:stream=codec_name,sample_rate,channels,duration",
+               "-of", "json", audio_file_path]
+    try:
+        probe_output = subprocess.run(command, capture_output=True, check=True, text=True).stdout
+    except FileNotFoundError:
+        raise ValueError("ffprobe was not found. Make sure ffmpeg is installed.")
+    except subprocess.CalledProcessError as error:
+        raise ValueError(f"The file could not be read: {error.stderr.strip()}")
+
+    probe_info = json.loads(probe_output)
+    streams = probe_info.get("streams", [])
+    if len(streams) == 0:
+        raise ValueError("The file does not contain an audio stream.")
+    stream = streams[0]
+
+    # Some containers only report the duration at the stream level
+    duration = probe_info.get("format", {}).get("duration", stream.get("duration"))
+    if duration is None or float(duration) <= 0:
+        raise ValueError("The duration of the file could not be read. The file may be corrupt or truncated.")
+
+    return AudioProbe(path=audio_file_path,
+                      duration=float(duration),
+                      sample_rate=int(stream.get("sample_rate", 0)),
+                      channels=int(stream.get("channels", 0)),
+                      codec=stream.get("codec_name", "unknown"))
+
+
+def probe_audio_directory(directory_path: str, max_workers: int = 8, check_file=None):
+    """
+    This method probes every file in the directory at directory_path in parallel (ffprobe runs in its own
+    process, so a thread pool is enough) and returns a tuple (valid_probes, invalid_files):
+
+        - valid_probes: a List of AudioProbe, sorted from longest to shortest duration so that the longest jobs
+          can be scheduled first
+        - invalid_files: a dict mapping the path of each rejected file to the reason it was rejected
+
+    If check_file is given, it is called first on each file path (in the same worker) and returns the reason to
+    reject the file, or None to probe it (eg, the MIME type check the app runs on single files).
+    """
+    file_paths = [os.path.join(directory_path, file_name) for file_name in sorted(os.listdir(directory_path))
+                  if os.path.isfile(os.path.join(directory_path, file_name))]
+
+    def _probe_or_error(file_path):
+        if check_file is not None:
+            reason = check_file(file_path)
+            if reason is not None:
+                return reason
+        try:
+            return probe_audio_file(file_path)
+        except ValueError as error:
+            return str(error)
+
+    valid_probes = []
+    invalid_files = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for file_path, result in zip(file_paths, executor.map(_probe_or_error, file_paths)):
+            if isinstance(result, AudioProbe):
+                valid_probes.append(result)
+            else:
+                invalid_files[file_path] = result
+    valid_probes.sort(key=lambda probe: probe.duration, reverse=True)
+    return valid_probes, invalid_files
+
+
+def format_duration(duration: float) -> str:
+    """Returns duration (in seconds) as a HH:MM:SS string."""
+    duration = int(round(duration))
+    return f"{duration // 3600:02d}:{duration % 3600 // 60:02d}:{duration % 60:02d}"
+
+
+def estimate_diarization_time(audio_duration: float) -> float:
+    """Returns a rough estimate (in seconds) of the time speaker diarization takes on audio_duration seconds of audio."""
+    return audio_duration / ESTIMATED_DIARIZATION_SPEED
+
+
+def estimate_whisper_time(audio_duration: float, model_size: str, num_whisper_passes: int) -> float:
+    """
+    Returns a rough estimate (in seconds) of the time the Whisper model of size model_size takes to transcribe or
+    translate audio_duration seconds of audio num_whisper_passes times.
+    """
+    whisper_speed = ESTIMATED_WHISPER_SPEEDS.get(model_size, min(ESTIMATED_WHISPER_SPEEDS.values()))
+    return audio_duration * num_whisper_passes / whisper_speed
@@ -0,0 +1,110 @@
+## Import statements ##
+import os
+import uuid
+
+# pyarrow is an optional dependency, only needed for the Parquet export written alongside the CSV file
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+TRANSCRIBE_TASK = "transcribe"
+TRANSLATE_TASK = "translate"
+
+
+def writing_res_to_records(transcript_result, trans_result, source_file: str, detected_language: str,
+                           model_size: str, process: str):
+    """
+    This method returns a List of dicts (one per diarized sentence) intended to be written into a columnar
+    (Parquet) file by the method write_records_to_parquet.
+
+    Unlike writing_solo_res_to_csv, the speakers are NOT grouped together and the start/end timestamps are kept
+    as floats (in seconds), so sub-second precision is not lost and no timestamp strings need to be re-parsed.
+
+    The records are in long format: the transcription and the translation come from separate Whisper runs with
+    different segmentations, so each of their sentences is written as its own row, with its own timestamps and
+    speaker, and a "task" column telling whether the text is the transcription or the English translation.
+    Either transcript_result or trans_result can be None (eg, when user selects "Transcription only").
+
+    :param transcript_result: output of display_timestamps_speaker_and_text for the transcription, or None
+    :param trans_result: output of display_timestamps_speaker_and_text for the translation, or None
+    :return: List of dicts
+    """
+    records = []
+    for task, comb_result in ((TRANSCRIBE_TASK, transcript_result), (TRANSLATE_TASK, trans_result)):
+        for i, (seg, speaker, text) in enumerate(comb_result or []):
+            records.append({
+                "source_file": source_file,
+                "task": task,
+                "segment_index": i,
+                "start": float(seg.start),
+                "end": float(seg.end),
+                "speaker": str(speaker),
+                "text": text,
+                "detected_language": detected_language,
+                "model_size": model_size,
+                "process": process,
+            })
+    return records
+
+
+def parquet_output_path(output_csv_path: str, parquet_dataset_path: str = None) -> str:
+    """
+    Returns the path of the Parquet file written for the job whose CSV file is output_csv_path.
+
+    If parquet_dataset_path is None, the Parquet file is written next to the CSV file (one file per job).
+    Otherwise, a new uniquely named file is added to the Parquet dataset directory parquet_dataset_path, so a
+    whole corpus of interviews can later be loaded with a single columnar scan (eg, with pyarrow.dataset).
+    """
+    csv_name = os.path.splitext(os.path.basename(output_csv_path))[0]
+    if parquet_dataset_path is None:
+        return os.path.join(os.path.dirname(output_csv_path), csv_name + ".parquet")
+    return os.path.join(parquet_dataset_path, csv_name + "_" + uuid.uuid4().hex[:8] + ".parquet")
+
+
+def write_records_to_parquet(records, output_path: str) -> None:
+    """
+    This method writes the List of dicts returned by writing_res_to_records into the Parquet file at output_path.
+
+    Preconditions:
+        - pyarrow is installed (see requirements.txt)
+    """
+    if pyarrow is None:
+        raise ImportError("pyarrow is required to write Parquet files. Run: pip install pyarrow")
+    schema = pyarrow.schema([
+        ("source_file", pyarrow.string()),
+        ("task", pyarrow.string()),
+        ("segment_index", pyarrow.int32()),
+        ("start", pyarrow.float64()),
+        ("end", pyarrow.float64()),
+        ("speaker", pyarrow.string()),
+        ("text", pyarrow.string()),
+        ("detected_language", pyarrow.string()),
+        ("model_size", pyarrow.string()),
+        ("process", pyarrow.string()),
+    ])
+    table = pyarrow.Table.from_pylist(records, schema=schema)
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    pyarrow.parquet.write_table(table, output_path)
+
+
+def copy_parquet_with_source_file(input_path: str, output_path: str, source_file: str) -> None:
+    """
+    This method copies the Parquet file at input_path to output_path, with the source_file column set to
+    source_file (eg, when the output of an earlier copy of the same audio is reused under a new name).
+
+    Preconditions:
+        - pyarrow is installed (see requirements.txt)
+    """
+    if pyarrow is None:
+        raise ImportError("pyarrow is required to write Parquet files. Run: pip install pyarrow")
+    table = pyarrow.parquet.read_table(input_path)
+    source_file_index = table.schema.get_field_index("source_file")
+    table = table.set_column(source_file_index, "source_file", pyarrow.array([source_file] * len(table), pyarrow.string()))
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    pyarrow.parquet.write_table(table, output_path)
@@ -0,0 +1,226 @@
+## Import statements ##
+import math
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from pyannote.core import Segment, Annotation
+from backend.speaker_index import SpeakerIndex, is_valid_embedding
+
+LONG_AUDIO_SPEAKER_PREFIX = "SPEAKER_"
+MIN_SPEECH_TO_NOISE_DB = 6.0  # Min difference between the loud frames and the noise floor for speech to be detected
+
+
+def detect_speech_regions(waveform, sample_rate: int, frame_duration: float = 0.03, noise_percentile: float = 10.0,
+                          margin_db: float = 10.0, min_silence_duration: float = 0.5, min_speech_duration: float = 0.25,
+                          padding_duration: float = 0.2):
+    """
+    This method runs a cheap energy-based voice activity detection on waveform (a 1D numpy array) and returns
+    a List of (start_sample, end_sample) tuples for the regions that contain speech.
+
+    The noise floor of the recording is estimated as the noise_percentile-th percentile of the frame energies,
+    and a frame is considered speech if its energy is more than margin_db above it. The threshold is kept halfway
+    below the loud frames of the recording (99th percentile), so speech is still detected at a low signal-to-noise
+    ratio. Since the threshold only depends on the quietest and loudest frames, it works the same whether the
+    recording is mostly speech or mostly silence (eg, multi-hour field recordings).
+    Silences shorter than min_silence_duration are merged into the surrounding speech, speech regions
+    shorter than min_speech_duration are dropped, and every region is padded by padding_duration on both sides.
+    """
+    frame_length = int(frame_duration * sample_rate)
+    num_frames = len(waveform) // frame_length
+    if num_frames == 0:
+        return []
+    frames = waveform[:num_frames * frame_length].reshape(num_frames, frame_length)
+    frame_energy_db = 10 * np.log10(np.mean(frames.astype(np.float64) ** 2, axis=1) + 1e-10)
+    noise_floor_db = np.percentile(frame_energy_db, noise_percentile)
+    loud_db = np.percentile(frame_energy_db, 99)
+    if loud_db - noise_floor_db < MIN_SPEECH_TO_NOISE_DB:
+        # No frame stands out from the noise floor (eg, digital silence or background noise only)
+        return []
+    is_speech = frame_energy_db > min(noise_floor_db + margin_db, (noise_floor_db + loud_db) / 2)
+
+    # Find the (start_frame, end_frame) runs of speech frames
+    changes = np.diff(np.concatenate([[0], is_speech.astype(np.int8), [0]]))
+    run_starts = np.flatnonzero(changes == 1)
+    run_ends = np.flatnonzero(changes == -1)
+
+    regions = []
+    for start_frame, end_frame in zip(run_starts, run_ends):
+        if regions and (start_frame - regions[-1][1]) * frame_duration < min_silence_duration:
+            regions[-1][1] = end_frame
+        else:
+            regions.append([start_frame, end_frame])
+
+    padding = int(padding_duration * sample_rate)
+    speech_regions = []
+    for start_frame, end_frame in regions:
+        if (end_frame - start_frame) * frame_duration < min_speech_duration:
+            continue
+        start_sample = max(0, start_frame * frame_length - padding)
+        end_sample = min(len(waveform), end_frame * frame_length + padding)
+        if speech_regions and start_sample <= speech_regions[-1][1]:
+            speech_regions[-1] = (speech_regions[-1][0], end_sample)
+        else:
+            speech_regions.append((start_sample, end_sample))
+    return speech_regions
+
+
+def build_windows(speech_regions, sample_rate: int, max_window_duration: float = 600.0):
+    """
+    This method splits the speech regions returned by detect_speech_regions into windows holding at most
+    max_window_duration seconds of speech each.
+
+    The speech is spread evenly over the smallest possible number of windows, and windows are cut between speech
+    regions (ie, in silences) whenever possible. Only regions longer than a window are cut inside speech.
+    A short last window, for which Pyannote would give no or unreliable embeddings, is merged into the previous
+    window, or the 2 windows are evened out if they do not fit in one.
+
+    It returns a List of windows, where each window is a List of (start_sample, end_sample) pieces of the
+    original recording.
+    """
+    max_window_length = int(max_window_duration * sample_rate)
+    # Regions longer than a window have to be cut inside speech: cut them into equal pieces
+    pieces = []
+    for start_sample, end_sample in speech_regions:
+        num_pieces = math.ceil((end_sample - start_sample) / max_window_length)
+        bounds = np.linspace(start_sample, end_sample, num_pieces + 1).astype(int)
+        pieces.extend(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+    total_length = sum(end_sample - start_sample for start_sample, end_sample in pieces)
+    if total_length == 0:
+        return []
+    target_length = total_length / math.ceil(total_length / max_window_length)
+
+    windows = []
+    curr_window = []
+    curr_window_length = 0
+    for start_sample, end_sample in pieces:
+        piece_length = end_sample - start_sample
+        # Close the window in the silence before this piece if the piece does not fit in it,
+        # or if adding the piece takes the window further away from the target length
+        if curr_window and (curr_window_length + piece_length > max_window_length
+                            or abs(curr_window_length + piece_length - target_length) > abs(curr_window_length - target_length)):
+            windows.append(curr_window)
+            curr_window = []
+            curr_window_length = 0
+        curr_window.append((start_sample, end_sample))
+        curr_window_length += piece_length
+    windows.append(curr_window)
+
+    if len(windows) > 1 and _window_length(windows[-1]) < target_length / 2:
+        last_pieces = windows.pop(-2) + windows.pop(-1)
+        last_length = _window_length(last_pieces)
+        if last_length <= max_window_length:
+            windows.append(last_pieces)
+        else:
+            windows.extend(_split_window(last_pieces, last_length // 2))
+    return windows
+
+
+def _window_length(window) -> int:
+    """Returns the number of samples of speech in window."""
+    return sum(end_sample - start_sample for start_sample, end_sample in window)
+
+
+def _split_window(window, first_length: int):
+    """Splits window into 2 windows, the first one holding first_length samples of speech."""
+    first_window = []
+    second_window = []
+    curr_length = 0
+    for start_sample, end_sample in window:
+        if curr_length >= first_length:
+            second_window.append((start_sample, end_sample))
+        elif curr_length + end_sample - start_sample <= first_length:
+            first_window.append((start_sample, end_sample))
+        else:
+            cut_sample = start_sample + first_length - curr_length
+            first_window.append((start_sample, cut_sample))
+            second_window.append((cut_sample, end_sample))
+        curr_length += end_sample - start_sample
+    return [first_window, second_window]
+
+
+def diarize_window(diarize_model, waveform, window, sample_rate: int):
+    """
+    This method runs diarize_model on the speech-only audio of window (the pieces are concatenated, so
+    silences are not processed) and returns a tuple (annotation, embeddings) where:
+
+        - annotation is the diarization result, mapped back to the time of the original recording
+        - embeddings maps each speaker label of annotation to its embedding
+    """
+    window_waveform = np.concatenate([waveform[start_sample:end_sample] for start_sample, end_sample in window])
+    window_audio_data = {
+        'waveform': torch.from_numpy(window_waveform[None, :]),
+        'sample_rate': sample_rate
+    }
+    window_result, window_embeddings = diarize_model(window_audio_data, return_embeddings=True)
+
+    # (start, end) of each piece in the concatenated audio, in seconds
+    piece_bounds = []
+    concat_start = 0.0
+    for start_sample, end_sample in window:
+        concat_end = concat_start + (end_sample - start_sample) / sample_rate
+        piece_bounds.append((concat_start, concat_end, start_sample / sample_rate))
+        concat_start = concat_end
+
+    annotation = Annotation()
+    for track, (seg, _, label) in enumerate(window_result.itertracks(yield_label=True)):
+        for concat_start, concat_end, orig_start in piece_bounds:
+            overlap_start = max(seg.start, concat_start)
+            overlap_end = min(seg.end, concat_end)
+            if overlap_end > overlap_start:
+                orig_seg = Segment(orig_start + overlap_start - concat_start, orig_start + overlap_end - concat_start)
+                annotation[orig_seg, track] = label
+    embeddings = dict(zip(window_result.labels(), window_embeddings))
+    return annotation, embeddings
+
+
+def diarize_long_audio(diarize_model, audio_data, return_embeddings: bool = False, max_window_duration: float = 600.0,
+                       max_workers: int = 1, similarity_threshold: float = 0.5):
+    """
+    This method is a drop-in replacement for calling diarize_model(audio_data) on long recordings.
+
+    Only the speech regions found by detect_speech_regions are diarized, in windows of at most
+    max_window_duration seconds of speech. This bounds the memory used by the pipeline and skips long silences. The speakers of every window are then reconciled by the cosine
+    similarity of their embeddings, and a single Annotation in the time of the original recording is returned.
+
+    If return_embeddings is true, a tuple (annotation, embeddings) is returned, where embeddings is a
+    (num_speakers, dim) numpy array whose rows follow the order of annotation.labels(), like the pipeline does.
+
+    :param diarize_model: the Pyannote speaker-diarization-3.1 pipeline
+    :param audio_data: dict with keys 'waveform' (a (1, num_samples) tensor) and 'sample_rate'
+    :param max_workers: number of windows diarized at a time. The windows share the same pipeline, which has not
+        been checked to be safe to call from several threads, and each window running at a time adds to the peak
+        memory (eg, on a single GPU), so this should be left to 1 unless diarize_model can be called concurrently
+    """
+    sample_rate = audio_data['sample_rate']
+    waveform = audio_data['waveform'][0].numpy()
+    windows = build_windows(detect_speech_regions(waveform, sample_rate), sample_rate, max_window_duration)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        window_results = list(executor.map(lambda window: diarize_window(diarize_model, waveform, window, sample_rate),
+                                           windows))
+
+    # Reconcile the window-local speaker labels into labels shared by the whole recording
+    speaker_index = SpeakerIndex(similarity_threshold=similarity_threshold, id_prefix=LONG_AUDIO_SPEAKER_PREFIX)
+    diarization_result = Annotation()
+    track = 0
+    for window_index, (window_annotation, window_embeddings) in enumerate(window_results):
+        mapping = {}
+        for label in window_annotation.labels():
+            embedding = window_embeddings.get(label)
+            if embedding is not None and is_valid_embedding(embedding):
+                mapping[label] = speaker_index.match_or_add(embedding, exclude=mapping.values())
+            else:
+                # Without an embedding, this speaker cannot be matched with the speakers of other windows
+                mapping[label] = label + "_WINDOW_" + str(window_index)
+        for seg, _, label in window_annotation.itertracks(yield_label=True):
+            diarization_result[seg, track] = mapping[label]
+            track += 1
+
+    if not return_embeddings:
+        return diarization_result
+    if len(speaker_index) == 0:
+        return diarization_result, np.zeros((0, 0), dtype=np.float32)
+    embeddings = [speaker_index.centroid(label) if label in speaker_index.speaker_ids
+                  else np.full(speaker_index.centroids.shape[1], np.nan, dtype=np.float32)
+                  for label in diarization_result.labels()]
+    return diarization_result, np.stack(embeddings)
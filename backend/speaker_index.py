@@ -0,0 +1,204 @@
+## Import statements ##
+import hashlib
+import os
+import numpy as np
+from pyannote.core import Segment, Annotation
+
+GLOBAL_SPEAKER_PREFIX = "GLOBAL_SPEAKER_"
+
+
+class SpeakerIndex:
+    """
+    A persistent index of speaker embeddings shared across recordings.
+
+    Each run of the Pyannote pipeline labels speakers SPEAKER_00, SPEAKER_01, ... independently, so the same
+    person gets a different label in every file. This index stores one centroid embedding per known speaker
+    (as a numpy matrix saved in a .npz file) and matches the speakers of a new recording to their nearest
+    centroid using cosine similarity, so they can be relabeled to stable global IDs.
+
+    Diarization results and per-speaker embeddings are also cached per audio hash in embedding_cache_dir,
+    so relabeling a whole corpus does not re-run speaker diarization.
+    """
+
+    def __init__(self, index_path: str = None, similarity_threshold: float = 0.5,
+                 id_prefix: str = GLOBAL_SPEAKER_PREFIX):
+        """
+        Loads the index stored at index_path (a .npz file) if it exists, otherwise starts an empty index.
+        If index_path is None, the index only lives in memory (eg, to reconcile speakers within one recording).
+
+        :param index_path: path to the .npz file holding the index, or None. The .npz extension is added if
+            missing, since numpy adds it when saving the index
+        :param similarity_threshold: minimum cosine similarity for a speaker to match a known speaker
+        :param id_prefix: prefix of the speaker IDs created by this index
+        """
+        if index_path is not None and not index_path.endswith(".npz"):
+            index_path += ".npz"
+        self.index_path = index_path
+        self.similarity_threshold = similarity_threshold
+        self.id_prefix = id_prefix
+        self.embedding_cache_dir = None
+        if index_path is not None:
+            self.embedding_cache_dir = os.path.splitext(index_path)[0] + "_embedding_cache"
+        self.speaker_ids = []
+        self.centroids = None  # (num_speakers, dim) matrix of L2-normalized centroids
+        self.counts = None  # number of embeddings averaged into each centroid
+        # Maps the hash of each audio file that contributed to the index to its {local label: global ID} mapping,
+        # so relabeling the same file again is a lookup that does not update the centroids a second time
+        self.assignments = {}
+        if index_path is not None and os.path.isfile(index_path):
+            with np.load(index_path) as index_file:
+                if len(index_file["speaker_ids"]) > 0:
+                    self.speaker_ids = [str(speaker_id) for speaker_id in index_file["speaker_ids"]]
+                    self.centroids = index_file["centroids"].astype(np.float32)
+                    self.counts = index_file["counts"].astype(np.int64)
+                if "assignment_hashes" in index_file.files:
+                    for audio_hash, label, speaker_id in zip(index_file["assignment_hashes"],
+                                                             index_file["assignment_labels"],
+                                                             index_file["assignment_ids"]):
+                        self.assignments.setdefault(str(audio_hash), {})[str(label)] = str(speaker_id)
+
+    def __len__(self):
+        return len(self.speaker_ids)
+
+    def nearest(self, embedding, exclude=()):
+        """
+        Returns a tuple (speaker_id, cosine_similarity) of the known speaker closest to embedding,
+        or (None, -1.0) if the index is empty. Speaker IDs in exclude are skipped.
+        """
+        if len(self) == 0:
+            return None, -1.0
+        similarities = self.centroids @ _normalize(embedding)
+        for speaker_id in exclude:
+            if speaker_id in self.speaker_ids:
+                similarities[self.speaker_ids.index(speaker_id)] = -np.inf
+        best = int(np.argmax(similarities))
+        if not np.isfinite(similarities[best]):
+            return None, -1.0
+        return self.speaker_ids[best], float(similarities[best])
+
+    def match_or_add(self, embedding, exclude=()) -> str:
+        """
+        Returns the global ID of the known speaker matching embedding, updating its centroid.
+        If no known speaker is similar enough, a new global ID is created for this embedding.
+        Speaker IDs in exclude (eg, already assigned to another speaker of the same recording) are never matched.
+        """
+        embedding = _normalize(embedding)
+        speaker_id, similarity = self.nearest(embedding, exclude)
+        if speaker_id is not None and similarity >= self.similarity_threshold:
+            row = self.speaker_ids.index(speaker_id)
+            # Running mean of the embeddings assigned to this speaker, renormalized for cosine lookup
+            count = self.counts[row]
+            self.centroids[row] = _normalize(self.centroids[row] * count + embedding)
+            self.counts[row] = count + 1
+            return speaker_id
+
+        speaker_id = self.id_prefix + str(len(self)).zfill(3)
+        self.speaker_ids.append(speaker_id)
+        if self.centroids is None:
+            self.centroids = embedding[None, :]
+            self.counts = np.ones(1, dtype=np.int64)
+        else:
+            self.centroids = np.vstack([self.centroids, embedding[None, :]])
+            self.counts = np.append(self.counts, 1)
+        return speaker_id
+
+    def centroid(self, speaker_id: str):
+        """Returns the centroid embedding of the known speaker speaker_id."""
+        return self.centroids[self.speaker_ids.index(speaker_id)]
+
+    def save(self) -> None:
+        """Writes the index to index_path."""
+        if self.index_path is None:
+            raise ValueError("This speaker index has no index_path and only lives in memory.")
+        index_dir = os.path.dirname(self.index_path)
+        if index_dir:
+            os.makedirs(index_dir, exist_ok=True)
+        assignments = [(audio_hash, label, speaker_id) for audio_hash, mapping in self.assignments.items()
+                       for label, speaker_id in mapping.items()]
+        np.savez(self.index_path,
+                 speaker_ids=np.array(self.speaker_ids, dtype=str),
+                 centroids=self.centroids if self.centroids is not None else np.zeros((0, 0), dtype=np.float32),
+                 counts=self.counts if self.counts is not None else np.zeros(0, dtype=np.int64),
+                 assignment_hashes=np.array([assignment[0] for assignment in assignments], dtype=str),
+                 assignment_labels=np.array([assignment[1] for assignment in assignments], dtype=str),
+                 assignment_ids=np.array([assignment[2] for assignment in assignments], dtype=str))
+
+
+def is_valid_embedding(embedding) -> bool:
+    """
+    Returns whether embedding can be used to identify a speaker. Pyannote pads the embeddings of speakers
+    it could not compute one for (eg, speakers who talk too little) with zeros, or NaN in some versions.
+    """
+    embedding = np.asarray(embedding)
+    return embedding.size > 0 and bool(np.all(np.isfinite(embedding))) and bool(np.any(embedding))
+
+
+def _normalize(embedding):
+    """Returns embedding as a float32 vector with an L2 norm of 1."""
+    embedding = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(embedding)
+    if norm == 0:
+        return embedding
+    return embedding / norm
+
+
+def hash_audio_file(audio_file_path: str) -> str:
+    """Returns the SHA-256 hex digest of the content of the audio file at audio_file_path."""
+    sha = hashlib.sha256()
+    with open(audio_file_path, "rb") as audio_file:
+        for chunk in iter(lambda: audio_file.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def diarize_with_embedding_cache(diarize_model, audio_data, audio_hash: str, embedding_cache_dir: str):
+    """
+    This method returns a tuple (diarization_result, embeddings) for the audio in audio_data.
+
+    embeddings is a (num_speakers, dim) numpy array whose rows follow the order of diarization_result.labels().
+    If a cached result exists for audio_hash in embedding_cache_dir, it is returned without running the
+    pipeline. Otherwise, the pipeline is run with return_embeddings=True and the result is cached.
+
+    :param diarize_model: the Pyannote speaker-diarization-3.1 pipeline
+    :param audio_data: dict with keys 'waveform' and 'sample_rate', as passed to diarize_model
+    """
+    cache_path = os.path.join(embedding_cache_dir, audio_hash + ".npz")
+    if os.path.isfile(cache_path):
+        with np.load(cache_path) as cache_file:
+            diarization_result = Annotation()
+            for i, (start, end, label) in enumerate(zip(cache_file["starts"], cache_file["ends"], cache_file["labels"])):
+                diarization_result[Segment(float(start), float(end)), i] = str(label)
+            return diarization_result, cache_file["embeddings"]
+
+    diarization_result, embeddings = diarize_model(audio_data, return_embeddings=True)
+    tracks = list(diarization_result.itertracks(yield_label=True))
+    os.makedirs(embedding_cache_dir, exist_ok=True)
+    np.savez(cache_path,
+             starts=np.array([seg.start for seg, _, _ in tracks], dtype=np.float64),
+             ends=np.array([seg.end for seg, _, _ in tracks], dtype=np.float64),
+             labels=np.array([label for _, _, label in tracks], dtype=str),
+             embeddings=np.asarray(embeddings, dtype=np.float32))
+    return diarization_result, embeddings
+
+
+def relabel_with_speaker_index(diarization_result, embeddings, speaker_index: SpeakerIndex, audio_hash: str = None):
+    """
+    This method returns a copy of diarization_result where the local speaker labels (SPEAKER_00, ...) are
+    replaced by the stable global IDs found in speaker_index. Speakers that are not yet in the index are added.
+
+    If audio_hash is given and this audio file already contributed to speaker_index, its earlier mapping is reused
+    without updating the index, so relabeling the same corpus several times gives the same index.
+
+    Speakers without a valid embedding (eg, speakers who talk too little for Pyannote to compute one)
+    keep their local label.
+    """
+    if audio_hash is not None and audio_hash in speaker_index.assignments:
+        return diarization_result.rename_labels(mapping=speaker_index.assignments[audio_hash])
+
+    mapping = {}
+    for label, embedding in zip(diarization_result.labels(), embeddings):
+        if is_valid_embedding(embedding):
+            mapping[label] = speaker_index.match_or_add(embedding, exclude=mapping.values())
+    if audio_hash is not None:
+        speaker_index.assignments[audio_hash] = mapping
+    return diarization_result.rename_labels(mapping=mapping)
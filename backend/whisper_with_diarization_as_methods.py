@@ -5,9 +5,17 @@ import time
 from datetime import datetime
 from pyannote.audio import Pipeline
 from backend.merge_timestamps import diarize_text
+from backend.columnar_export import pyarrow, writing_res_to_records, parquet_output_path, write_records_to_parquet, \
+    copy_parquet_with_source_file
+from backend.audio_dedup import DedupRegistry, hash_pcm, compute_fingerprint, job_key
+from backend.audio_probe import probe_audio_file, format_duration, estimate_diarization_time, estimate_whisper_time
+from backend.long_audio_diarization import diarize_long_audio
+from backend.speaker_index import SpeakerIndex, hash_audio_file, diarize_with_embedding_cache, relabel_with_speaker_index
 from iso639 import Lang
 import torch
 import os
+import functools
+import shutil
 
 def define_whisper_model(model_path: str, is_english: bool):
     """
@@ -290,7 +298,33 @@ def write_list_to_csv(list_of_csv_content, output_csv_path: str, output_csv_head
             comb_lang_csv_writer.writerow(list_of_csv_content[i])
     comb_lang_csv_file.close()
 
-def main(process_selected: str, input_file: str, to_english_selection: bool, model_size_selection: str, destination_selection: str, diarize_model):
+def main(process_selected: str, input_file: str, to_english_selection: bool, model_size_selection: str, destination_selection: str, diarize_model,
+         parquet_dataset_path: str = None, speaker_index_path: str = None, audio_duration: float = None,
+         long_audio_mode: bool = False, dedup_registry_dir: str = None, processing_speed: float = None):
+    """
+    Runs the whole diarization + transcription/translation process on input_file and writes the result as a CSV file
+    in destination_selection.
+
+    If pyarrow is installed, the segment-level results are also written as a Parquet file next to the CSV file, or
+    added to the Parquet dataset directory parquet_dataset_path when it is given (see backend/columnar_export.py).
+
+    If speaker_index_path is given, speakers are relabeled to stable global IDs shared across recordings using the
+    speaker index stored at that path (see backend/speaker_index.py).
+
+    audio_duration (in seconds) is used to print time estimates before the long stages run. If it is not given, it is
+    read from the file headers. processing_speed (seconds of audio processed per second, eg measured on the previous
+    files of a batch) replaces the rough default speeds in the first estimate when it is given.
+
+    Returns the time (in seconds) it took to process the file, or None if the file was not processed.
+
+    If long_audio_mode is true, only the speech regions of the file are diarized, in bounded-size windows
+    (see backend/long_audio_diarization.py). This is recommended for multi-hour recordings.
+
+    If dedup_registry_dir is given, the decoded audio is fingerprinted before any model is loaded. If the same audio
+    (eg, under another name or in another format) was already processed by the same job (same process, model size,
+    language selection and diarization settings), the earlier CSV and Parquet files are re-emitted under the new
+    name instead of running the process again (see backend/audio_dedup.py).
+    """
 
     # Step 1: Defining input audio path + defining CSV Headers
     input_audio_path = os.path.normpath(input_file)
@@ -335,29 +369,100 @@ def main(process_selected: str, input_file: str, to_english_selection: bool, mod
         return  # TODO: Will need to clean this up after we do further testing on windows
 
     print("This will be the output path: ", output_csv_path)
+    if audio_duration is None:
+        audio_duration = probe_audio_file(input_audio_path).duration
+    print("Duration of the input audio file: ", format_duration(audio_duration))
+
+    # Step 2: Checking whether the same audio was already processed by the same job, so its outputs can be reused
+    the_audio = None
+    if dedup_registry_dir is not None:
+        the_audio = whisper.load_audio(input_audio_path, 16000)
+        dedup_registry = DedupRegistry(dedup_registry_dir)
+        audio_pcm_hash = hash_pcm(the_audio)
+        audio_fingerprint = compute_fingerprint(the_audio, 16000)
+        dedup_job = job_key(output_format, model_size_selection, to_english_selection, long_audio_mode,
+                            speaker_index_path is not None)
+        duplicate_match = dedup_registry.find_match(audio_pcm_hash, audio_fingerprint)
+        if duplicate_match is not None and duplicate_match.kind == "contained":
+            print(f"Part of this audio file was already processed as {duplicate_match.source_file}. "
+                  f"Its output cannot be reused since the timestamps differ, so the file will be processed again.\n")
+        elif duplicate_match is not None and dedup_job in duplicate_match.outputs:
+            reused_outputs = duplicate_match.outputs[dedup_job]
+            # The outputs are only reused if all of them can be re-emitted, so no file goes missing from the dataset
+            is_csv_reusable = os.path.isfile(reused_outputs["csv"])
+            is_parquet_reusable = pyarrow is None or (reused_outputs["parquet"] is not None
+                                                      and os.path.isfile(reused_outputs["parquet"]))
+            if is_csv_reusable and is_parquet_reusable:
+                print(f"This audio file was already processed as {duplicate_match.source_file}. Reusing its output...\n")
+                shutil.copyfile(reused_outputs["csv"], output_csv_path)
+                print("CSV file has been created. Process is complete\n")
+                if pyarrow is not None:
+                    output_parquet_path = parquet_output_path(output_csv_path, parquet_dataset_path)
+                    copy_parquet_with_source_file(reused_outputs["parquet"], output_parquet_path, audio_name)
+                    print("Parquet file has been created: ", output_parquet_path)
+                return None
+
     translate_to_english = to_english_selection # True denotes that file is in ENG. Only transcription is needed
+    num_whisper_passes = 2 if (output_format == "transcribe_translate" and translate_to_english != "Yes") else 1
+    if processing_speed is not None:
+        estimated_time = audio_duration / processing_speed
+    else:
+        estimated_time = estimate_diarization_time(audio_duration) + estimate_whisper_time(audio_duration, model_size_selection, num_whisper_passes)
+    print(f"Estimated processing time: about {format_duration(estimated_time)}\n")
+    processing_start_time = time.time()
 
     # Step 3: Defining whisper model
     loaded_whisper_model = define_whisper_model(model_size_selection, translate_to_english)
 
     # Step 4: Processing and printing out detected language
     if (translate_to_english == "Yes"):
+        whisper_detect_lang = "English"
         print("Detected language in input audio file: English\n")
     else:
         whisper_detect_lang = detecting_language(loaded_whisper_model, input_audio_path)
         print(f'Detected language in input audio file: {whisper_detect_lang}\n')
 
     print("Speaker diarization has started, in progress\n")
-    diarize_model = diarize_model
-    the_audio = whisper.load_audio(input_audio_path, 16000)
+    diarization_start_time = time.time()
+    if long_audio_mode:
+        diarize_model = functools.partial(diarize_long_audio, diarize_model)
+    if the_audio is None:
+        the_audio = whisper.load_audio(input_audio_path, 16000)
     audio_data = {
         'waveform': torch.from_numpy(the_audio[None, :]),
         'sample_rate': 16000
     }
-    diarization_result = diarize_model(audio_data)
-    print("Speaker diarization has completed\n")
+    # The diarization speed only tells how fast this machine is if the pipeline ran on the whole audio
+    is_full_diarization = not long_audio_mode
+    if speaker_index_path is not None:
+        speaker_index = SpeakerIndex(speaker_index_path)
+        audio_hash = hash_audio_file(input_audio_path)
+        if long_audio_mode:
+            # The long-audio mode gives a different diarization, so it is cached separately
+            audio_hash += "_long_audio"
+        if os.path.isfile(os.path.join(speaker_index.embedding_cache_dir, audio_hash + ".npz")):
+            is_full_diarization = False
+        diarization_result, speaker_embeddings = diarize_with_embedding_cache(diarize_model, audio_data, audio_hash,
+                                                                              speaker_index.embedding_cache_dir)
+        diarization_result = relabel_with_speaker_index(diarization_result, speaker_embeddings, speaker_index,
+                                                        audio_hash)
+        speaker_index.save()
+    else:
+        diarization_result = diarize_model(audio_data)
+    diarization_elapsed_time = time.time() - diarization_start_time
+    print(f"Speaker diarization has completed in {format_duration(diarization_elapsed_time)} "
+          f"({audio_duration / max(diarization_elapsed_time, 1e-6):.1f}x real time)\n")
+    estimated_whisper_time = estimate_whisper_time(audio_duration, model_size_selection, num_whisper_passes)
+    if is_full_diarization:
+        # The speed of this machine compared to the rough default speeds, measured on the diarization stage.
+        # It is not measured on a cached diarization (which takes no time) or in the long-audio mode (which skips the
+        # silences that Whisper still processes), so the rough default speeds are used then
+        estimated_whisper_time *= diarization_elapsed_time / max(estimate_diarization_time(audio_duration), 1e-6)
+    print(f"Estimated time for the transcription/translation: about {format_duration(estimated_whisper_time)}\n")
 
     # Step 6: Running conditional checks. The code to run will differ based on whether detected language is ENG or not.
+    transcript_final_result = None
+    trans_lang_final_result = None
     if (process_selected == "Transcription Only"):
         print("Transcribing audio file\n")
         transcript_whisper_result = transcribe_audio(loaded_whisper_model, input_audio_path, is_translate=False)
@@ -397,3 +502,23 @@ def main(process_selected: str, input_file: str, to_english_selection: bool, mod
         print("Finished both transcription and translation. Writing output as a CSV file to destination...\n")
         write_list_to_csv(combo_csv_content, output_csv_path, output_csv_headers)
         print("CSV file has been created. Process is complete\n")
+
+    # Step 7: Writing the segment-level results in a columnar format, if the optional dependency is installed
+    output_parquet_path = None
+    if pyarrow is not None:
+        parquet_records = writing_res_to_records(transcript_final_result, trans_lang_final_result, audio_name,
+                                                 whisper_detect_lang, model_size_selection, output_format)
+        output_parquet_path = parquet_output_path(output_csv_path, parquet_dataset_path)
+        write_records_to_parquet(parquet_records, output_parquet_path)
+        print("Parquet file has been created: ", output_parquet_path)
+    elif parquet_dataset_path is not None:
+        print("pyarrow is not installed, so no Parquet file was added to the dataset. Run: pip install pyarrow\n")
+
+    processing_time = time.time() - processing_start_time
+
+    # Step 8: Recording this audio file in the deduplication registry, so later copies can reuse its output
+    if dedup_registry_dir is not None:
+        dedup_registry.add(audio_pcm_hash, audio_fingerprint, input_audio_path, dedup_job, output_csv_path,
+                           output_parquet_path)
+
+    return processing_time
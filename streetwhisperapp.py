@@ -1,4 +1,5 @@
 from backend import whisper_with_diarization_as_methods
+from backend.audio_probe import probe_audio_file, probe_audio_directory, format_duration
 import os
 import magic
 import typer
@@ -10,14 +11,25 @@ from pyannote.audio import Pipeline
 app = typer.Typer()
 
 def startup_ui(howtouse: bool = typer.Option(False, '-howtouse', help="How to use the tool"),
-               credits: bool = typer.Option(False, '-credits', help="Credits")):
+               credits: bool = typer.Option(False, '-credits', help="Credits"),
+               parquetdataset: str = typer.Option(None, '-parquetdataset', help="Folder of a Parquet dataset to add the results to (requires pyarrow)"),
+               speakerindex: str = typer.Option(None, '-speakerindex', help="Path to a .npz speaker index, to give speakers the same labels across recordings"),
+               longaudio: bool = typer.Option(False, '-longaudio', help="Only diarize the speech of the audio, in bounded windows (for multi-hour recordings)"),
+               dedupregistry: str = typer.Option(None, '-dedupregistry', help="Folder of a registry of processed audio, to reuse the outputs of duplicate files")):
     """This function creates a UI based on the command given by the user."""
     if not howtouse and not credits:
         # When no option is passed in, the app will start
         rprint("[magenta]=============================[magenta]")
         rprint("[bold][underline]STREET Lab Whisper App[underline][bold]")
         rprint("[magenta]=============================[magenta]")
-        authorization()
+        # Optional settings passed in as options, forwarded as is to the backend
+        backend_options = {
+            'parquet_dataset_path': parquetdataset,
+            'speaker_index_path': speakerindex,
+            'long_audio_mode': longaudio,
+            'dedup_registry_dir': dedupregistry,
+        }
+        authorization(backend_options)
     if howtouse and not credits:
         # When -howtouse is used, it will display the help section
         howtouse_ui()
@@ -49,31 +61,75 @@ def validate_path(input_path: str, is_intended_file: bool) -> bool:
         else:
             return False
 
-def validate_audio_file(audio_file_path: str) -> bool:
+def check_supported_file_type(audio_file_path: str):
+    """
+    This function utilizes calls from the python-magic-bin==0.4.14 library to check whether the MIME type of the file
+    denoted by the path: audio_file_path is one that Whisper can interpret.
+
+    Returns None if it is, otherwise the reason why the file is rejected.
+    """
+    try:
+        validate_audio_path_msg = magic.from_file(audio_file_path, mime=True)
+    except:
+        return "There was an error reading in the name of the file because it contains a non UTF-8 character. Update the file name and try again."
+    supported_file_extensions = {"mpeg", "mp4", "wav", "webm", "flac", "ogg", "adts"}
+    #Note: In above line, mpeg include checks for mpeg, mp3 and mpga. mp4 includes checks for .mp4 and .m4a
+    # adts files can include some audio files disguised as mp3/mp4
+    for file_ext in supported_file_extensions:
+        if file_ext in validate_audio_path_msg:
+            return None
+    return "The file type is not supported by Whisper. If you think this is not the case, please contact the developers."
+
+def validate_audio_file(audio_file_path: str):
     """
     This function utilizes calls from the python-magic-bin==0.4.14 library to check whether or not the file denoted
     by the path: audio_file_path is a valid audio file that can be interpreted by Whisper.
 
+    The container headers are then read with ffprobe (see backend/audio_probe.py) to check that the file is not
+    corrupt or truncated, without decoding the audio.
+
+    Returns the AudioProbe of the file (with its duration, sample rate, etc) if it is valid, otherwise None.
+
     Preconditions:
         - Audio file inputs are either .wav or .mp3. Whisper can process more audio file inputs, but the checking for
         other "types" of files has not been implemented yet
     """
+    unsupported_reason = check_supported_file_type(audio_file_path)
+    if unsupported_reason is not None:
+        print(unsupported_reason)
+        return None
+
+    # Read the container headers, so corrupt or truncated files are rejected before the models are loaded
     try:
-        validate_audio_path_msg = magic.from_file(audio_file_path, mime=True)
-        supported_file_extensions = {"mpeg", "mp4", "wav", "webm", "flac", "ogg", "adts"}
-        #Note: In above line, mpeg include checks for mpeg, mp3 and mpga. mp4 includes checks for .mp4 and .m4a
-        # adts files can include some audio files disguised as mp3/mp4
-        for file_ext in supported_file_extensions:
-            if file_ext in validate_audio_path_msg:
-                return True
-        print("The file type is not supported by Whisper. If you think this is not the case, please contact the developers.")
-        return False
-    except: 
-        print("There was an error reading in the name of the file because it contains a non UTF-8 character. Update the file name and try again.")
-        return False
+        audio_probe = probe_audio_file(audio_file_path)
+    except ValueError as error:
+        print(f"The audio file cannot be processed. {error}")
+        return None
+    print(f"Audio duration: {format_duration(audio_probe.duration)}, sample rate: {audio_probe.sample_rate} Hz, "
+          f"channels: {audio_probe.channels}, codec: {audio_probe.codec}")
+    return audio_probe
+
+def validate_audio_directory(directory_path: str) -> list:
+    """
+    This function checks all the files in the directory denoted by the path: directory_path in parallel, with the
+    same checks as validate_audio_file: their MIME type, then their container headers (see backend/audio_probe.py).
+    It prints the files that cannot be processed.
+
+    Returns the AudioProbe of each valid file, from longest to shortest, so the longest files are processed first.
+    """
+    audio_probes, invalid_files = probe_audio_directory(directory_path, check_file=check_supported_file_type)
+    for file_path, reason in invalid_files.items():
+        print(f"Skipping {file_path}: {reason}")
+    if len(audio_probes) == 0:
+        print("No audio file that Whisper can process was found in this folder.")
+        return audio_probes
+    total_duration = sum(audio_probe.duration for audio_probe in audio_probes)
+    print(f"Found {len(audio_probes)} audio files, with a total duration of {format_duration(total_duration)}")
+    return audio_probes
 
-def authorization():
-    """This function deals with access token authentication, catching errors, keyboard interruptions, and more."""
+def authorization(backend_options):
+    """This function deals with access token authentication, catching errors, keyboard interruptions, and more.
+    backend_options holds the optional settings given as options when starting the app."""
     access_token_prompt = [
         {
             'type': 'password',
@@ -87,7 +143,7 @@ def authorization():
     try:
         # Check token
         diarize_model = Pipeline.from_pretrained("pyannote/speaker-diarization-3.1", use_auth_token=str(potential_access_token["password"]))
-        questions_ui(diarize_model)
+        questions_ui(diarize_model, backend_options)
         typer.Exit()
     except KeyError:
         # You reach here if you click on a selection in the prompt selection instead of
@@ -109,7 +165,7 @@ def authorization():
         ]
         key_error = prompt(invalidKeyError)
         if key_error != {} and key_error["key_error"] == 'I would like to try again':
-            authorization()
+            authorization(backend_options)
         else:
             typer.Exit()
 
@@ -133,11 +189,11 @@ def authorization():
         ]
         invalid_token = prompt(invalidTokenPrompt)
         if invalid_token["invalid_token"] == 'Yes':
-            authorization()
+            authorization(backend_options)
         else:
             typer.Exit()
 
-def questions_ui(diarize_model):
+def questions_ui(diarize_model, backend_options):
     """This function asks prompts about the audio file that the user wants to translate
     or perform transcription on and conducts file checks. Afterwards, information
     is passed to backend."""
@@ -171,22 +227,27 @@ def questions_ui(diarize_model):
         return
     # Input file
     rprint("[blue]=============================[blue]")
-    rprint(f"[bold]Enter the absolute path to the audio file you want to do the \"{process_selected['process_selected']}\" process on:[bold]")
+    rprint(f"[bold]Enter the absolute path to the audio file (or to a folder of audio files) you want to do the \"{process_selected['process_selected']}\" process on:[bold]")
 
     # Check if audio file path is a valid path within system that CLI is running from
 
     while True:
         input_file = input()
         input_audio_path = input_file.strip()  # remove leading and trailing whitespace from the input path ONLY
-        is_valid_audio_path = validate_path(input_audio_path, True)
+        is_valid_audio_path = validate_path(input_audio_path, True) or validate_path(input_audio_path, False)
         if is_valid_audio_path:
             break
         else:
             print("You entered an invalid audio path. Please try again:")
 
-    # Check if the referenced audio file itself is one that Whisper can process
-    is_valid_audio_file = validate_audio_file(input_audio_path)
-    if not (is_valid_audio_file):
+    if validate_path(input_audio_path, False):
+        # A folder was given: check all of its files in parallel, before any model is loaded
+        audio_probes = validate_audio_directory(input_audio_path)
+    else:
+        # Check if the referenced audio file itself is one that Whisper can process
+        audio_probe = validate_audio_file(input_audio_path)
+        audio_probes = [audio_probe] if audio_probe is not None else []
+    if len(audio_probes) == 0:
         return
 
     rprint("[blue]=============================[blue]")
@@ -271,8 +332,24 @@ def questions_ui(diarize_model):
         ]
     questions_finished = prompt(questions_finished_prompt)
     if questions_finished["questions_finished"] == 'Yes':
-        # Run process
-        whisper_with_diarization_as_methods.main(process_selected["process_selected"], input_file, to_english_selection["to_english_selection"], model_size_selection["model_size_selection"], destination_selection, diarize_model)
+        # Run process on each file, longest first. The speed measured on the files already processed is used
+        # to estimate the time left for the batch
+        processed_duration = 0.0
+        processing_time = 0.0
+        remaining_duration = sum(audio_probe.duration for audio_probe in audio_probes)
+        for i, audio_probe in enumerate(audio_probes):
+            processing_speed = processed_duration / processing_time if processing_time > 0 else None
+            if len(audio_probes) > 1:
+                rprint("[blue]=============================[blue]")
+                rprint(f"[bold]File {i + 1} of {len(audio_probes)}: {audio_probe.path}[bold]")
+                if processing_speed is not None:
+                    print(f"Estimated time left for the batch: about {format_duration(remaining_duration / processing_speed)}")
+            file_processing_time = whisper_with_diarization_as_methods.main(process_selected["process_selected"], audio_probe.path, to_english_selection["to_english_selection"], model_size_selection["model_size_selection"], destination_selection, diarize_model,
+                                                                            audio_duration=audio_probe.duration, processing_speed=processing_speed, **backend_options)
+            remaining_duration -= audio_probe.duration
+            if file_processing_time is not None:
+                processed_duration += audio_probe.duration
+                processing_time += file_processing_time
     else:
         # Exit out of app
         typer.Exit()
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+from backend.audio_dedup import DedupRegistry, hash_pcm, compute_fingerprint, job_key
+
+SAMPLE_RATE = 16000
+
+
+def _speech_like(duration, seed):
+    """Returns duration sec of syllable-like harmonic bursts separated by short pauses."""
+    rng = np.random.default_rng(seed)
+    num_samples = duration * SAMPLE_RATE
+    waveform = np.zeros(num_samples)
+    position = 0
+    while position < num_samples:
+        syllable_length = int(rng.uniform(0.1, 0.4) * SAMPLE_RATE)
+        pause_length = int(rng.uniform(0.02, 0.3) * SAMPLE_RATE)
+        t = np.arange(syllable_length) / SAMPLE_RATE
+        pitch = rng.uniform(90, 250)
+        syllable = sum(np.sin(2 * np.pi * pitch * k * t) * np.exp(-((pitch * k - rng.uniform(300, 2500)) / 400) ** 2)
+                       for k in range(1, 25)) * np.hanning(syllable_length)
+        end = min(num_samples, position + syllable_length)
+        waveform[position:end] += syllable[:end - position]
+        position = end + pause_length
+    return waveform.astype(np.float32)
+
+
+@pytest.fixture(scope="module")
+def registered_audio(tmp_path_factory):
+    waveform = _speech_like(60, seed=0)
+    registry_dir = str(tmp_path_factory.mktemp("registry"))
+    DedupRegistry(registry_dir).add(hash_pcm(waveform), compute_fingerprint(waveform), "a.wav", "job", "a.csv")
+    return waveform, registry_dir
+
+
+def _find_match(registry_dir, waveform):
+    # A new registry instance, so the inverted index is read back from disk
+    return DedupRegistry(registry_dir).find_match(hash_pcm(waveform), compute_fingerprint(waveform))
+
+
+def test_identical_audio_is_an_exact_match(registered_audio):
+    waveform, registry_dir = registered_audio
+    match = _find_match(registry_dir, waveform.copy())
+    assert match.kind == "exact"
+    assert match.source_file == "a.wav"
+    assert match.outputs == {"job": {"csv": "a.csv", "parquet": None}}
+
+
+@pytest.mark.parametrize("shift", [0.01, 0.025])
+def test_shifted_copy_is_a_near_match(registered_audio, shift):
+    waveform, registry_dir = registered_audio
+    match = _find_match(registry_dir, waveform[int(shift * SAMPLE_RATE):])
+    assert match.kind == "near"
+    assert match.bit_error_rate < 0.1
+
+
+def test_padded_copy_is_a_near_match(registered_audio):
+    waveform, registry_dir = registered_audio
+    padded = np.concatenate([np.zeros(int(0.025 * SAMPLE_RATE), dtype=np.float32), waveform])
+    assert _find_match(registry_dir, padded).kind == "near"
+
+
+def test_reencoded_copy_is_a_near_match(registered_audio):
+    waveform, registry_dir = registered_audio
+    noise = np.random.default_rng(1).normal(0, 0.01, len(waveform)).astype(np.float32)
+    assert _find_match(registry_dir, 0.7 * waveform + noise).kind == "near"
+
+
+def test_trimmed_copy_is_a_contained_match(registered_audio):
+    waveform, registry_dir = registered_audio
+    match = _find_match(registry_dir, waveform[13 * SAMPLE_RATE:50 * SAMPLE_RATE])
+    assert match.kind == "contained"
+    assert match.offset == pytest.approx(13.0, abs=0.05)
+
+    repadded = np.concatenate([np.zeros(int(0.025 * SAMPLE_RATE), dtype=np.float32),
+                               waveform[13 * SAMPLE_RATE:50 * SAMPLE_RATE]])
+    match = _find_match(registry_dir, repadded)
+    assert match.kind == "contained"
+    assert match.offset == pytest.approx(12.975, abs=0.05)
+
+
+
+def test_copy_offset_by_more_than_encoder_delay_is_a_contained_match(registered_audio):
+    # Reusing the outputs would give timestamps that are wrong by the offset
+    waveform, registry_dir = registered_audio
+    match = _find_match(registry_dir, waveform[int(0.5 * SAMPLE_RATE):])
+    assert match.kind == "contained"
+    assert match.offset == pytest.approx(0.5, abs=0.02)
+
+
+def test_unrelated_audio_does_not_match(registered_audio):
+    _, registry_dir = registered_audio
+    assert _find_match(registry_dir, _speech_like(60, seed=2)) is None
+
+
+def test_job_key_depends_on_the_whole_job():
+    key = job_key("transcribe", "small", "No", False, False)
+    assert key == job_key("transcribe", "small", "No", False, False)
+    assert key != job_key("transcribe", "medium", "No", False, False)
+    assert key != job_key("transcribe", "small", "Yes", False, False)
+    assert key != job_key("transcribe", "small", "No", True, False)
+    assert key != job_key("transcribe", "small", "No", False, True)
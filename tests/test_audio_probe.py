@@ -0,0 +1,76 @@
+import json
+import subprocess
+import pytest
+from backend import audio_probe
+from backend.audio_probe import (AudioProbe, probe_audio_file, probe_audio_directory, format_duration,
+                                 estimate_diarization_time, estimate_whisper_time)
+
+FFPROBE_OUTPUTS = {
+    "long.wav": {"streams": [{"codec_name": "pcm_s16le", "sample_rate": "16000", "channels": 1}],
+                 "format": {"duration": "3600.5"}},
+    "short.mp3": {"streams": [{"codec_name": "mp3", "sample_rate": "44100", "channels": 2}],
+                  "format": {"duration": "61.0"}},
+    "stream_duration.ogg": {"streams": [{"codec_name": "opus", "sample_rate": "48000", "channels": 1, "duration": "12.5"}],
+                            "format": {}},
+    "image.png": {"streams": [], "format": {"duration": "0.04"}},
+    "truncated.wav": {"streams": [{"codec_name": "pcm_s16le", "sample_rate": "16000", "channels": 1}], "format": {}},
+}
+
+
+@pytest.fixture
+def fake_ffprobe(monkeypatch):
+    """Replaces the ffprobe call with the outputs in FFPROBE_OUTPUTS, keyed by file name."""
+    def fake_run(command, capture_output, check, text):
+        file_name = command[-1].replace("\\", "/").split("/")[-1]
+        if file_name == "corrupt.m4a":
+            raise subprocess.CalledProcessError(1, command, stderr="moov atom not found\n")
+        return subprocess.CompletedProcess(command, 0, stdout=json.dumps(FFPROBE_OUTPUTS[file_name]))
+    monkeypatch.setattr(audio_probe.subprocess, "run", fake_run)
+
+
+def test_probe_audio_file(fake_ffprobe):
+    assert probe_audio_file("long.wav") == AudioProbe("long.wav", 3600.5, 16000, 1, "pcm_s16le")
+    assert probe_audio_file("stream_duration.ogg").duration == 12.5
+
+
+@pytest.mark.parametrize("file_name, message", [
+    ("image.png", "audio stream"),
+    ("truncated.wav", "duration"),
+    ("corrupt.m4a", "moov atom not found"),
+])
+def test_probe_audio_file_rejects_bad_files(fake_ffprobe, file_name, message):
+    with pytest.raises(ValueError, match=message):
+        probe_audio_file(file_name)
+
+
+def test_probe_audio_directory(fake_ffprobe, tmp_path):
+    for file_name in ["short.mp3", "long.wav", "image.png", "corrupt.m4a", "stream_duration.ogg"]:
+        (tmp_path / file_name).write_bytes(b"")
+    audio_probes, invalid_files = probe_audio_directory(str(tmp_path))
+    assert [probe.path for probe in audio_probes] == [str(tmp_path / "long.wav"), str(tmp_path / "short.mp3"),
+                                                      str(tmp_path / "stream_duration.ogg")]
+    assert sorted(invalid_files) == [str(tmp_path / "corrupt.m4a"), str(tmp_path / "image.png")]
+
+
+
+def test_probe_audio_directory_runs_check_file_first(fake_ffprobe, tmp_path):
+    for file_name in ["short.mp3", "long.wav"]:
+        (tmp_path / file_name).write_bytes(b"")
+
+    def reject_wav(file_path):
+        return "The file type is not supported by Whisper." if file_path.endswith(".wav") else None
+
+    audio_probes, invalid_files = probe_audio_directory(str(tmp_path), check_file=reject_wav)
+    assert [probe.path for probe in audio_probes] == [str(tmp_path / "short.mp3")]
+    assert invalid_files == {str(tmp_path / "long.wav"): "The file type is not supported by Whisper."}
+
+
+def test_format_duration():
+    assert format_duration(0) == "00:00:00"
+    assert format_duration(3661.4) == "01:01:01"
+
+
+def test_estimates():
+    assert estimate_diarization_time(600) == 300
+    assert estimate_whisper_time(600, "large-v2", 2) == 2 * estimate_whisper_time(600, "large-v2", 1)
+    assert estimate_whisper_time(600, "small", 1) < estimate_whisper_time(600, "large-v2", 1)
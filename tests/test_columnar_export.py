@@ -0,0 +1,56 @@
+import os
+from collections import namedtuple
+import pytest
+from backend.columnar_export import writing_res_to_records, parquet_output_path, write_records_to_parquet, \
+    copy_parquet_with_source_file
+
+Seg = namedtuple("Seg", ["start", "end"])
+
+TRANSCRIPT_RESULT = [(Seg(0.0, 1.25), "SPEAKER_00", "Hola."), (Seg(1.25, 3.5), "SPEAKER_01", "Que tal?")]
+TRANS_RESULT = [(Seg(0.0, 3.5), "SPEAKER_00", "Hello. How are you?")]
+
+
+def test_records_keep_each_task_with_its_own_timestamps():
+    records = writing_res_to_records(TRANSCRIPT_RESULT, TRANS_RESULT, "a.wav", "Spanish", "small", "transcribe_translate")
+    assert [(r["task"], r["start"], r["end"], r["speaker"], r["text"]) for r in records] == [
+        ("transcribe", 0.0, 1.25, "SPEAKER_00", "Hola."),
+        ("transcribe", 1.25, 3.5, "SPEAKER_01", "Que tal?"),
+        ("translate", 0.0, 3.5, "SPEAKER_00", "Hello. How are you?"),
+    ]
+
+
+def test_records_with_a_single_task():
+    records = writing_res_to_records(None, TRANS_RESULT, "a.wav", "Spanish", "small", "translation")
+    assert len(records) == 1
+    assert records[0]["task"] == "translate"
+    assert records[0]["segment_index"] == 0
+
+
+def test_parquet_output_path(tmp_path):
+    csv_path = os.path.join(str(tmp_path), "a.wav_transcription_10_5.csv")
+    assert parquet_output_path(csv_path) == os.path.join(str(tmp_path), "a.wav_transcription_10_5.parquet")
+    dataset_path = parquet_output_path(csv_path, os.path.join(str(tmp_path), "dataset"))
+    assert os.path.dirname(dataset_path) == os.path.join(str(tmp_path), "dataset")
+    assert dataset_path != parquet_output_path(csv_path, os.path.join(str(tmp_path), "dataset"))
+
+
+def test_write_records_to_parquet(tmp_path):
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+    records = writing_res_to_records(TRANSCRIPT_RESULT, TRANS_RESULT, "a.wav", "Spanish", "small", "transcribe_translate")
+    output_path = os.path.join(str(tmp_path), "dataset", "a.parquet")
+    write_records_to_parquet(records, output_path)
+    table = pyarrow_parquet.read_table(output_path)
+    assert table.column("start").to_pylist() == [0.0, 1.25, 0.0]
+    assert table.column("task").to_pylist() == ["transcribe", "transcribe", "translate"]
+
+
+def test_copy_parquet_with_source_file(tmp_path):
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+    records = writing_res_to_records(TRANSCRIPT_RESULT, TRANS_RESULT, "a.wav", "Spanish", "small", "transcribe_translate")
+    input_path = os.path.join(str(tmp_path), "a.parquet")
+    write_records_to_parquet(records, input_path)
+    output_path = os.path.join(str(tmp_path), "dataset", "b.parquet")
+    copy_parquet_with_source_file(input_path, output_path, "b.mp3")
+    table = pyarrow_parquet.read_table(output_path)
+    assert table.column("source_file").to_pylist() == ["b.mp3"] * 3
+    assert table.column("text").to_pylist() == pyarrow_parquet.read_table(input_path).column("text").to_pylist()
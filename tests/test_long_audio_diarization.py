@@ -0,0 +1,134 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+from backend.long_audio_diarization import detect_speech_regions, build_windows
+
+SAMPLE_RATE = 16000
+
+
+def _speech_like(rng, num_samples):
+    return rng.normal(0, 0.3, num_samples).astype(np.float32)
+
+
+def test_detect_speech_regions():
+    rng = np.random.default_rng(0)
+    waveform = rng.normal(0, 1e-4, 20 * SAMPLE_RATE).astype(np.float32)
+    waveform[2 * SAMPLE_RATE:5 * SAMPLE_RATE] += _speech_like(rng, 3 * SAMPLE_RATE)
+    # A silence shorter than min_silence_duration is merged into the surrounding speech
+    waveform[5 * SAMPLE_RATE + 1000:8 * SAMPLE_RATE] += _speech_like(rng, 3 * SAMPLE_RATE - 1000)
+    waveform[15 * SAMPLE_RATE:16 * SAMPLE_RATE] += _speech_like(rng, SAMPLE_RATE)
+    regions = [(start / SAMPLE_RATE, end / SAMPLE_RATE) for start, end in detect_speech_regions(waveform, SAMPLE_RATE)]
+    assert len(regions) == 2
+    assert regions[0] == pytest.approx((2.0, 8.0), abs=0.3)
+    assert regions[1] == pytest.approx((15.0, 16.0), abs=0.3)
+
+
+def test_detect_speech_regions_in_silence():
+    assert detect_speech_regions(np.zeros(10, dtype=np.float32), SAMPLE_RATE) == []
+    assert detect_speech_regions(np.zeros(10 * SAMPLE_RATE, dtype=np.float32), SAMPLE_RATE) == []
+    noise = np.random.default_rng(3).normal(0, 0.01, 10 * SAMPLE_RATE).astype(np.float32)
+    assert detect_speech_regions(noise, SAMPLE_RATE) == []
+
+
+def _speech_over_noise(rng, duration, speech_starts, speech_duration, noise_db):
+    """Returns duration sec of noise noise_db below the speech, with speech_duration sec of speech at each start."""
+    waveform = rng.normal(0, 0.3 * 10 ** (-noise_db / 20), duration * SAMPLE_RATE).astype(np.float32)
+    for start in speech_starts:
+        waveform[start * SAMPLE_RATE:(start + speech_duration) * SAMPLE_RATE] += _speech_like(rng, speech_duration * SAMPLE_RATE)
+    return waveform
+
+
+def _region_durations(regions):
+    return [(start / SAMPLE_RATE, end / SAMPLE_RATE) for start, end in regions]
+
+
+def test_detect_speech_regions_in_a_mostly_silent_recording():
+    # 2% of speech: the 95th percentile of the frame energies is the noise floor itself
+    rng = np.random.default_rng(4)
+    waveform = _speech_over_noise(rng, 600, [100, 400], 6, noise_db=70)
+    regions = _region_durations(detect_speech_regions(waveform, SAMPLE_RATE))
+    assert len(regions) == 2
+    assert regions[0] == pytest.approx((100.0, 106.0), abs=0.3)
+    assert regions[1] == pytest.approx((400.0, 406.0), abs=0.3)
+
+
+@pytest.mark.parametrize("noise_db", [20, 30])
+def test_detect_speech_regions_with_a_realistic_noise_floor(noise_db):
+    # 10% of speech over a noise floor 20 to 30 dB below it
+    rng = np.random.default_rng(5)
+    speech_starts = list(range(30, 600, 60))
+    waveform = _speech_over_noise(rng, 600, speech_starts, 6, noise_db=noise_db)
+    regions = _region_durations(detect_speech_regions(waveform, SAMPLE_RATE))
+    assert len(regions) == len(speech_starts)
+    for (start, end), speech_start in zip(regions, speech_starts):
+        assert (start, end) == pytest.approx((speech_start, speech_start + 6.0), abs=0.3)
+
+
+def _check_windows(windows, speech_regions, max_window_duration):
+    pieces = [piece for window in windows for piece in window]
+    # Every sample of speech is in exactly one window, in order
+    assert sum(end - start for start, end in pieces) == sum(end - start for start, end in speech_regions)
+    assert all(pieces[i][1] <= pieces[i + 1][0] for i in range(len(pieces) - 1))
+    lengths = [sum(end - start for start, end in window) / SAMPLE_RATE for window in windows]
+    assert max(lengths) <= max_window_duration
+    return lengths
+
+
+def test_build_windows_has_no_short_tail():
+    rng = np.random.default_rng(1)
+    speech_regions = []
+    curr_sample = 0
+    for _ in range(40):
+        curr_sample += int(rng.uniform(0.5, 3) * SAMPLE_RATE)
+        length = int(rng.uniform(0.3, 1.5) * SAMPLE_RATE)
+        speech_regions.append((curr_sample, curr_sample + length))
+        curr_sample += length
+    windows = build_windows(speech_regions, SAMPLE_RATE, max_window_duration=5)
+    lengths = _check_windows(windows, speech_regions, 5)
+    total_duration = sum(end - start for start, end in speech_regions) / SAMPLE_RATE
+    assert len(windows) <= int(np.ceil(total_duration / 5)) + 1
+    assert min(lengths) >= total_duration / len(windows) / 2
+    # Regions shorter than a window are never cut
+    assert all(piece in speech_regions for window in windows for piece in window)
+
+
+def test_build_windows_short_tail_that_does_not_fit():
+    speech_regions = [(0, 4 * SAMPLE_RATE), (5 * SAMPLE_RATE, 9 * SAMPLE_RATE), (10 * SAMPLE_RATE, 10 * SAMPLE_RATE + 1000)]
+    windows = build_windows(speech_regions, SAMPLE_RATE, max_window_duration=5)
+    lengths = _check_windows(windows, speech_regions, 5)
+    assert min(lengths) >= 1.0
+
+
+def test_build_windows_cuts_long_regions_evenly():
+    speech_regions = [(0, 12 * SAMPLE_RATE)]
+    windows = build_windows(speech_regions, SAMPLE_RATE, max_window_duration=5)
+    assert _check_windows(windows, speech_regions, 5) == [4.0, 4.0, 4.0]
+
+
+def test_diarize_long_audio_maps_windows_back_and_reconciles_speakers():
+    import torch
+    from pyannote.core import Segment, Annotation
+    from backend.long_audio_diarization import diarize_long_audio
+
+    def fake_pipeline(audio_data, return_embeddings=False):
+        # Labels the whole window as a single speaker, with the same embedding in every window
+        duration = audio_data['waveform'].shape[1] / audio_data['sample_rate']
+        window_result = Annotation()
+        window_result[Segment(0, duration)] = "SPEAKER_00"
+        return window_result, np.array([[1.0, 0.5]])
+
+    rng = np.random.default_rng(2)
+    waveform = rng.normal(0, 1e-4, 30 * SAMPLE_RATE).astype(np.float32)
+    waveform[2 * SAMPLE_RATE:6 * SAMPLE_RATE] += _speech_like(rng, 4 * SAMPLE_RATE)
+    waveform[20 * SAMPLE_RATE:24 * SAMPLE_RATE] += _speech_like(rng, 4 * SAMPLE_RATE)
+    audio_data = {'waveform': torch.from_numpy(waveform[None, :]), 'sample_rate': SAMPLE_RATE}
+
+    diarization_result, embeddings = diarize_long_audio(fake_pipeline, audio_data, return_embeddings=True,
+                                                        max_window_duration=5)
+    assert diarization_result.labels() == ["SPEAKER_000"]
+    segments = [(seg.start, seg.end) for seg in diarization_result.itersegments()]
+    assert len(segments) == 2
+    assert segments[0] == pytest.approx((2.0, 6.0), abs=0.3)
+    assert segments[1] == pytest.approx((20.0, 24.0), abs=0.3)
+    assert embeddings.shape == (1, 2)
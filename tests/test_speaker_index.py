@@ -0,0 +1,68 @@
+import numpy as np
+from pyannote.core import Segment, Annotation
+from backend.speaker_index import SpeakerIndex, is_valid_embedding, relabel_with_speaker_index
+
+
+def _diarization(labels):
+    diarization_result = Annotation()
+    for i, label in enumerate(labels):
+        diarization_result[Segment(i, i + 1), i] = label
+    return diarization_result
+
+
+def test_match_or_add_matches_similar_embeddings():
+    speaker_index = SpeakerIndex()
+    first_id = speaker_index.match_or_add([1.0, 0.0, 0.0])
+    assert speaker_index.match_or_add([0.9, 0.1, 0.0]) == first_id
+    assert speaker_index.match_or_add([0.0, 1.0, 0.0]) != first_id
+    assert speaker_index.match_or_add([1.0, 0.0, 0.0], exclude=[first_id]) != first_id
+    assert len(speaker_index) == 3
+
+
+def test_is_valid_embedding():
+    assert is_valid_embedding([0.1, 0.2])
+    assert not is_valid_embedding([0.0, 0.0])
+    assert not is_valid_embedding([np.nan, 0.2])
+
+
+def test_zero_embeddings_keep_their_local_label():
+    speaker_index = SpeakerIndex()
+    relabeled = relabel_with_speaker_index(_diarization(["SPEAKER_00", "SPEAKER_01"]),
+                                           np.array([[1.0, 0.0], [0.0, 0.0]]), speaker_index)
+    assert relabeled.labels() == ["GLOBAL_SPEAKER_000", "SPEAKER_01"]
+    assert len(speaker_index) == 1
+
+
+def test_relabeling_is_stable_across_recordings_and_idempotent(tmp_path):
+    index_path = str(tmp_path / "speakers.npz")
+    speaker_index = SpeakerIndex(index_path)
+    first = relabel_with_speaker_index(_diarization(["SPEAKER_00", "SPEAKER_01"]),
+                                       np.array([[1.0, 0.0], [0.0, 1.0]]), speaker_index, "hash_a")
+    speaker_index.save()
+
+    speaker_index = SpeakerIndex(index_path)
+    # In the second recording, the same people got the opposite local labels
+    second = relabel_with_speaker_index(_diarization(["SPEAKER_00", "SPEAKER_01"]),
+                                        np.array([[0.1, 1.0], [1.0, 0.1]]), speaker_index, "hash_b")
+    assert second.get_labels(Segment(0, 1)) == first.get_labels(Segment(1, 2)) == {"GLOBAL_SPEAKER_001"}
+    assert second.get_labels(Segment(1, 2)) == first.get_labels(Segment(0, 1)) == {"GLOBAL_SPEAKER_000"}
+    speaker_index.save()
+    centroids, counts = speaker_index.centroids.copy(), speaker_index.counts.copy()
+
+    # Relabeling the first recording again is a lookup, the index does not change
+    speaker_index = SpeakerIndex(index_path)
+    again = relabel_with_speaker_index(_diarization(["SPEAKER_00", "SPEAKER_01"]),
+                                       np.array([[1.0, 0.0], [0.0, 1.0]]), speaker_index, "hash_a")
+    assert again.get_labels(Segment(0, 1)) == {"GLOBAL_SPEAKER_000"}
+    assert np.array_equal(speaker_index.centroids, centroids)
+    assert np.array_equal(speaker_index.counts, counts)
+
+
+def test_index_path_without_extension(tmp_path):
+    speaker_index = SpeakerIndex(str(tmp_path / "speakers"))
+    first_id = speaker_index.match_or_add([1.0, 0.0, 0.0])
+    speaker_index.save()
+    assert (tmp_path / "speakers.npz").is_file()
+    reloaded = SpeakerIndex(str(tmp_path / "speakers"))
+    assert reloaded.speaker_ids == [first_id]
+    assert reloaded.embedding_cache_dir == str(tmp_path / "speakers_embedding_cache")